@@ -14,8 +14,176 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import List
+from collections import deque
+from typing import List, Optional, Tuple
 import numpy
+from numpy.lib.stride_tricks import as_strided
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def empty_aligned(shape: Tuple[int, ...], dtype,
+                  alignment: int = 64) -> numpy.ndarray:
+    """
+    Returns an uninitialized C-contiguous array whose data starts at an
+    address divisible by the given alignment, so vectorized loops can use
+    aligned loads.
+    """
+    dtype = numpy.dtype(dtype)
+    length = int(numpy.prod(shape)) * dtype.itemsize
+    raw = numpy.empty(length + alignment, dtype=numpy.uint8)
+    start = -raw.ctypes.data % alignment
+    return raw[start:start + length].view(dtype).reshape(shape)
+
+
+def forced_cells(tables: Tuple[numpy.ndarray, ...], indices: numpy.ndarray,
+                 signs: numpy.ndarray, satisfied: numpy.ndarray,
+                 forced: numpy.ndarray):
+    """
+    Fills the forced boolean array, whose rows mark the cells of a clause
+    where the corresponding literal is unknown and all other literals are
+    false. The value of literal k at cell i is
+    tables[k][indices[k, i]] * signs[k]. Cells marked in the satisfied
+    array are skipped, and newly satisfied cells are marked, so a cell
+    with two unknown literals is still scanned for a true one. This is
+    compiled with numba when it is available.
+    """
+    count, size = indices.shape
+    forced[:] = False
+    for i in range(size):
+        if satisfied[i]:
+            continue
+        # the only unknown literal, -1 if none and -2 if several
+        target = -1
+        for k in range(count):
+            value = tables[k][indices[k, i]] * signs[k]
+            if value > 0:
+                satisfied[i] = True
+                target = -1
+                break
+            elif value == 0:
+                target = k if target == -1 else -2
+        if target >= 0:
+            forced[target, i] = True
+
+
+# clauses with at least this many cells get a specialized kernel
+SPECIALIZE_CELLS = 1 << 14
+
+FORCED_KERNELS = {}
+
+# the maximum number of values gathered at once for a batch of states
+BATCH_BYTES = 1 << 22
+
+
+def forced_kernel(signs: Tuple[bool, ...]):
+    """
+    Returns a specialized version of forced_cells for clauses with the
+    given literal signs, taking the same arguments. The source is
+    generated with the loop over the literals unrolled and the signs
+    inlined, and it is compiled with numba. Generated code cannot use the
+    on-disk cache of numba, so this is only worth it for large clauses.
+    Kernels are cached by their signs for the lifetime of the process.
+    """
+    assert numba is not None
+    if signs in FORCED_KERNELS:
+        return FORCED_KERNELS[signs]
+
+    lines = [
+        "def kernel(tables, indices, signs, satisfied, forced):",
+    ]
+    for k in range(len(signs)):
+        lines += [
+            "    table{0} = tables[{0}]".format(k),
+            "    indices{0} = indices[{0}]".format(k),
+        ]
+    lines += [
+        "    forced[:] = False",
+        "    for i in range(satisfied.shape[0]):",
+        "        if satisfied[i]:",
+        "            continue",
+        "        target = -1",
+    ]
+    for k, sign in enumerate(signs):
+        lines += [
+            "        value = " + ("" if sign else "-") +
+            "table{0}[indices{0}[i]]".format(k),
+            "        if value > 0:",
+            "            satisfied[i] = True",
+            "            continue",
+            "        if value == 0:",
+            "            target = {0} if target == -1 else -2".format(k),
+        ]
+    lines += [
+        "        if target >= 0:",
+        "            forced[target, i] = True",
+    ]
+
+    scope = {}
+    exec("\n".join(lines), scope)
+    kernel = numba.njit(boundscheck=False)(scope["kernel"])
+
+    FORCED_KERNELS[signs] = kernel
+    return kernel
+
+
+def disjunction_cells(tables: Tuple[numpy.ndarray, ...],
+                      indices: numpy.ndarray, signs: numpy.ndarray,
+                      table: numpy.ndarray):
+    """
+    Fills the int8 table with the maximum of the literal values at each
+    cell of a clause, where the value of literal k at cell i is
+    tables[k][indices[k, i]] * signs[k]. This is compiled with numba when
+    it is available.
+    """
+    count, size = indices.shape
+    for i in range(size):
+        best = -1
+        for k in range(count):
+            value = tables[k][indices[k, i]] * signs[k]
+            if value > best:
+                best = value
+                if best > 0:
+                    break
+        table[i] = best
+
+
+def update_cells(table: numpy.ndarray, mask: numpy.ndarray, value: int,
+                 changed: numpy.ndarray, check: bool) -> int:
+    """
+    Sets the cells of the flat table selected by the flat mask to the given
+    value, and marks the cells that were zero before in the changed array.
+    Returns the number of changed cells. If check is set, then it first
+    verifies that no nonzero cell would change its sign, and returns -1
+    without writing anything otherwise. This is compiled with numba when
+    it is available.
+    """
+    if check and value != 0:
+        for i in range(table.shape[0]):
+            if mask[i] and table[i] == -value:
+                return -1
+    count = 0
+    for i in range(table.shape[0]):
+        if mask[i]:
+            if table[i] == 0:
+                changed[i] = True
+                count += 1
+            else:
+                changed[i] = False
+            table[i] = value
+        else:
+            changed[i] = False
+    return count
+
+
+if numba is not None:
+    forced_cells = numba.njit(cache=True, boundscheck=False)(forced_cells)
+    disjunction_cells = numba.njit(
+        cache=True, boundscheck=False)(disjunction_cells)
+    update_cells = numba.njit(cache=True, boundscheck=False)(update_cells)
 
 
 class Symbol:
@@ -34,6 +202,8 @@ class Symbol:
         self.name = name
         self.arity = arity
         self.table = None
+        self.changed = None
+        self.version = 0
 
     def __str__(self):
         return self.name + "(" + \
@@ -47,27 +217,51 @@ class Symbol:
         assert self.arity > 0 and self.table is not None
         return self.table.shape[0]
 
-    def create_table(self, size: int):
+    def create_table(self, size: int, buffer: Optional[numpy.ndarray] = None):
         """
         Creates an empty value table with full of zeros (undefined value).
+        If a flat int8 buffer of the right length is given, then the table
+        is a view into that buffer.
         """
         assert size >= 1
         shape = [size for _ in range(self.arity)]
-        self.table = numpy.zeros(shape=shape, dtype=numpy.int8)
+        if buffer is None:
+            buffer = empty_aligned(size ** self.arity, numpy.int8)
+        assert buffer.dtype == numpy.int8 and buffer.ndim == 1
+        buffer.fill(0)
+        self.table = buffer.reshape(shape)
+        self.changed = numpy.empty(buffer.shape, dtype=bool)
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Records that some values might have been cleared or overwritten,
+        so the clauses must drop their cached satisfied cells. This must be
+        called after writing the table directly.
+        """
+        self.version += 1
 
     def set_constant(self, value: int):
         """
         Set all values of the table to the given one.
         """
+        self.invalidate()
         self.table.fill(value)
 
     def set_equality(self):
         """
         Sets the value in the table to the equality relation of arity 2.
         """
-        assert self.arity == 2
-        self.table.fill(-1)
-        numpy.fill_diagonal(self.table, 1)
+        assert self.arity == 2 and self.table.flags.c_contiguous
+        self.invalidate()
+        size = self.get_size()
+
+        # after the first cell, rows of size + 1 end on the diagonal
+        table = self.table.reshape(-1)
+        table[0] = 1
+        rows = table[1:].reshape(size - 1, size + 1)
+        rows[:, :-1] = -1
+        rows[:, -1] = 1
 
     def update_masked(self, mask: numpy.ndarray, value: int) -> bool:
         """
@@ -77,20 +271,30 @@ class Symbol:
         something has been updated.
         """
         assert mask.ndim == self.arity and mask.dtype == bool
-
-        # tests if we are not overwriting anything that is already set
-        if value > 0:
-            assert not numpy.logical_and(self.table < 0, mask).any()
-        elif value < 0:
-            assert not numpy.logical_and(self.table > 0, mask).any()
-
-        changed = numpy.logical_and(self.table == 0, mask)
-        for coords in numpy.transpose(changed.nonzero()):
+        if value == 0:
+            self.invalidate()
+        mask = numpy.broadcast_to(mask, self.table.shape)
+        table = self.table.reshape(-1)
+
+        if numba is not None:
+            count = update_cells(table, numpy.ascontiguousarray(
+                mask).reshape(-1), value, self.changed, __debug__)
+            assert count >= 0
+            cells = numpy.flatnonzero(self.changed) if count > 0 else ()
+        else:
+            # only the selected cells are read and written
+            cells = numpy.flatnonzero(mask)
+            old = table[cells]
+            if __debug__ and value != 0:
+                assert not (old == -value).any()
+            table[cells] = value
+            cells = cells[old == 0]
+
+        for cell in cells:
+            coords = numpy.unravel_index(cell, self.table.shape)
             print("propagated " + self.name + "(" + ",".join([str(c) for c in coords]) +
                   ") = " + str(value))
-
-        self.table[mask] = value
-        return changed.any()
+        return len(cells) > 0
 
     def print_table(self):
         print(self.table.flatten())
@@ -125,6 +329,17 @@ class Literal:
         self.sign = sign
         self.vars = vars
         self.table = None
+        self.indices = None
+
+        # the coordinates of the relation where each variable appears
+        self.positions = tuple(
+            tuple(pos for pos, var2 in enumerate(vars) if var2 == var)
+            for var in range(arity))
+        self.dummy_axes = tuple(
+            var for var in range(arity) if not self.positions[var])
+        self.has_repeats = any(len(axes) > 1 for axes in self.positions)
+        self.symbol_mask = None
+        self.mask_view = None
 
     def __str__(self):
         return ("+" if self.sign else "-") + str(self.symbol.name) + \
@@ -137,46 +352,44 @@ class Literal:
         """
         return self.symbol.get_size()
 
-    def create_table(self):
+    def create_view(self, table: numpy.ndarray) -> numpy.ndarray:
         """
-        Creates a view into the underlying symbol table with properly
+        Returns a view into the given table of the symbol with properly
         permuted axes, repeated axes diagonalized and unused axes set
-        to new broadcasting dimensions of size 1.
-        """
-        table = self.symbol.table.view()
-        assert table is not None
-
-        # remove repeated axes
-        vars = []
-        for var in self.vars:
-            if var in vars:
-                idx = vars.index(var)
-                table = table.diagonal(
-                    axis1=idx, axis2=len(vars)).swapaxes(idx, -1)
-            else:
-                vars.append(var)
-        assert len(vars) == len(table.shape)
-
-        # add dummy axes
-        shape = list(table.shape)
-        shape.extend(1 for _ in range(self.arity - len(vars)))
-        table.shape = shape
-
-        # permute axes
-        unused = len(vars)
-        axes = []
-        for var in range(self.arity):
-            if var in vars:
-                axes.append(vars.index(var))
-            else:
-                axes.append(unused)
-                unused += 1
-        assert unused == self.arity
-        self.table = table.transpose(axes)
+        to new broadcasting dimensions of size 1. The view is created
+        directly from the strides of the table: the stride of a variable
+        is the sum of the strides of the coordinates it occupies.
+        """
+        shape = [table.shape[axes[0]] if axes else 1
+                 for axes in self.positions]
+        strides = [sum(table.strides[axis] for axis in axes)
+                   for axes in self.positions]
+        return as_strided(table, shape=shape, strides=strides)
+
+    def create_table(self):
+        """
+        Creates a view into the underlying symbol table and the matching
+        table of linear offsets into the flattened symbol table. These are
+        computed once, so updates only need a single gather and scatter.
+        """
+        assert self.symbol.table is not None
+        self.table = self.create_view(self.symbol.table.view())
 
         # make sure that we have a view to the original data
         assert self.table.dtype == numpy.int8
-        assert self.table.base is self.symbol.table
+        assert numpy.shares_memory(self.table, self.symbol.table)
+
+        indices = numpy.arange(self.symbol.table.size, dtype=numpy.int64)
+        self.indices = self.create_view(
+            indices.reshape(self.symbol.table.shape)).copy()
+        assert self.indices.shape == self.table.shape
+
+        # reused by every update
+        self.symbol_mask = numpy.empty(self.symbol.table.shape, dtype=bool)
+
+        # without repeated variables every symbol cell appears exactly once
+        if not self.has_repeats:
+            self.mask_view = self.create_view(self.symbol_mask.view())
 
     def update_masked(self, mask: numpy.ndarray, value: int) -> bool:
         """
@@ -197,45 +410,18 @@ class Literal:
             value = -value
 
         # remove dummy axes
-        axes = []
-        for var in self.vars:
-            if var not in axes:
-                axes.append(var)
-        keep = len(axes)
-        for var in range(self.arity):
-            if var not in axes:
-                axes.append(var)
-        mask = mask.view().transpose(axes)
-        if keep < self.arity:
-            # this might copy as last axis might not be continuous
-            mask = mask.reshape(list(mask.shape[:keep]) + [-1])
-            mask = mask.any(axis=-1, keepdims=False)
-
-        # zero arity case (no size info)
-        if keep == 0:
-            return self.symbol.update_masked(mask, value)
-
-        # calculate equality constraints and reshape
-        size = self.get_size()
-        eye1 = numpy.eye(size, dtype=bool)
-        equs = numpy.ones([size for _ in range(self.symbol.arity)], dtype=bool)
-
-        shape = []
-        for idx, var in enumerate(self.vars):
-            pos = self.vars.index(var)
-            if pos < idx:
-                shape.append(1)
-                eye2 = eye1.view()
-                eye2.shape = [size if i == pos or i == idx else 1
-                              for i in range(self.symbol.arity)]
-                equs = numpy.logical_and(equs, eye2)
-            else:
-                pos = axes.index(var)
-                shape.append(mask.shape[pos])
-
-        mask.shape = shape
-        mask = numpy.logical_and(mask, equs)
-        return self.symbol.update_masked(mask, value)
+        if self.dummy_axes:
+            mask = mask.any(axis=self.dummy_axes, keepdims=True)
+
+        if self.mask_view is not None:
+            # copy through the permuted view, no clearing is needed
+            self.mask_view[...] = mask
+        else:
+            # scatter into the flattened symbol table
+            mask = numpy.broadcast_to(mask, self.indices.shape)
+            self.symbol_mask.fill(False)
+            self.symbol_mask.reshape(-1)[self.indices[mask]] = True
+        return self.symbol.update_masked(self.symbol_mask, value)
 
     def set_constant(self, value: int):
         assert value in [-1, 0, 1]
@@ -250,6 +436,11 @@ class Literal:
         return self.table == (value if self.sign else -value)
 
     def get_table(self):
+        """
+        Returns the values of the literal. This is a view for positive
+        literals, but a new array for negative ones, so the clauses apply
+        the sign themselves instead.
+        """
         return self.table if self.sign else -self.table
 
     def get_value(self, coords: List[int]) -> int:
@@ -270,6 +461,21 @@ class Clause:
         self.arity = literals[0].arity
         assert all(lit.arity == self.arity for lit in literals[1:])
         self.literals = literals
+        self.shape = None
+
+        # whether the symbol of a literal is used by another literal
+        self.shared = [any(lit2.symbol is lit.symbol for lit2 in literals
+                           if lit2 is not lit) for lit in literals]
+        self.tables = None
+        self.indices = None
+        self.signs = None
+        self.satisfied_mask = None
+        self.finished = False
+        self.versions = None
+        self.falses = None
+        self.cells = None
+        self.forced = None
+        self.kernel = None
 
     def __str__(self):
         return ", ".join(str(lit) for lit in self.literals)
@@ -277,6 +483,45 @@ class Clause:
     def create_tables(self):
         for lit in self.literals:
             lit.create_table()
+        self.shape = numpy.broadcast_shapes(
+            *(lit.table.shape for lit in self.literals))
+
+        cells = int(numpy.prod(self.shape))
+
+        # the literals as a structure of arrays
+        self.tables = tuple(lit.symbol.table.reshape(-1)
+                            for lit in self.literals)
+        self.signs = numpy.array(
+            [1 if lit.sign else -1 for lit in self.literals], dtype=numpy.int8)
+
+        # satisfied cells stay satisfied until a symbol is invalidated
+        self.satisfied_mask = numpy.zeros(cells, dtype=bool)
+        self.finished = False
+        self.versions = self.get_versions()
+
+        # offsets and scratch buffers of the active path
+        if numba is not None:
+            # offsets are bounded by the size of the symbol tables
+            assert all(lit.symbol.table.size <= numpy.iinfo(numpy.int32).max
+                       for lit in self.literals)
+            self.indices = numpy.empty(
+                (len(self.literals), cells), dtype=numpy.int32)
+            for k, lit in enumerate(self.literals):
+                self.indices[k].reshape(self.shape)[...] = lit.indices
+
+            if cells >= SPECIALIZE_CELLS:
+                self.kernel = forced_kernel(
+                    tuple(lit.sign for lit in self.literals))
+            else:
+                self.kernel = forced_cells
+            self.forced = empty_aligned(self.indices.shape, bool)
+        else:
+            self.indices = None
+            self.kernel = None
+            self.falses = empty_aligned(self.shape, numpy.int8)
+            self.cells = empty_aligned(self.shape, bool)
+            self.forced = empty_aligned(
+                (len(self.literals),) + tuple(self.shape), bool)
 
         # do propagation here
         if len(self.literals) == 1:
@@ -286,11 +531,21 @@ class Clause:
         """
         Returns the disjunction of all literals.
         """
-        table = self.literals[0].get_table()
-        for lit in self.literals[1:]:
-            table = numpy.maximum(table, lit.get_table())
+        if self.indices is not None:
+            table = numpy.empty(self.indices.shape[1], dtype=numpy.int8)
+            disjunction_cells(self.tables, self.indices, self.signs, table)
+            return table.reshape(self.shape)
 
-        assert table.dtype == numpy.int8
+        # negative literals are maximized as the negated minimum
+        table = numpy.full(self.shape, -1, dtype=numpy.int8)
+        lowest = numpy.full(self.shape, 1, dtype=numpy.int8)
+        for lit in self.literals:
+            if lit.sign:
+                numpy.maximum(table, lit.table, out=table)
+            else:
+                numpy.minimum(lowest, lit.table, out=lowest)
+        numpy.negative(lowest, out=lowest)
+        numpy.maximum(table, lowest, out=table)
         return table
 
     def satisfied(self) -> int:
@@ -302,35 +557,98 @@ class Clause:
         """
         return numpy.amin(self.get_table())
 
-    def propagate(self) -> bool:
+    def propagate(self) -> List['Symbol']:
         """
-        Propagates forced values for this clause. Returns whether
-        anything has been updated.
+        Propagates forced values for this clause. Returns the list of
+        symbols that have been updated.
         """
+        # values might have been cleared since the last call
+        versions = self.get_versions()
+        if versions != self.versions:
+            self.versions = versions
+            self.clear_satisfied()
+
         # this is already done
-        if len(self.literals) <= 1:
-            return False
+        if len(self.literals) <= 1 or self.finished:
+            return []
 
-        updated = False
-        for target in range(len(self.literals)):
-            value1 = None
-            value2 = None
-            for idx, lit in enumerate(self.literals):
-                if idx == target:
-                    value2 = lit.get_table()
-                elif value1 is None:
-                    value1 = lit.get_table()
-                else:
-                    value1 = numpy.maximum(value1, lit.get_table())
-            assert value1.dtype == numpy.int8
-            forced = numpy.logical_and(value1 < 0, value2 == 0)
-
-            if self.literals[target].update_masked(forced, 1):
+        forced = self.get_forced()
+        if not forced.any():
+            # a satisfied clause stays satisfied until values are cleared
+            self.finished = bool(self.satisfied_mask.all())
+            return []
+
+        updated = []
+        for target, lit in enumerate(self.literals):
+            if not forced[target].any():
+                continue
+
+            if lit.update_masked(forced[target], 1):
                 print("  by " + str(self))
-                updated = True
+                if lit.symbol not in updated:
+                    updated.append(lit.symbol)
+
+                # only literals of the same symbol can change the forced
+                # cells of the remaining targets
+                if self.shared[target]:
+                    forced = self.get_forced()
 
         return updated
 
+    def get_versions(self) -> Tuple[int, ...]:
+        """
+        Returns the versions of the symbols of the literals.
+        """
+        return tuple(lit.symbol.version for lit in self.literals)
+
+    def clear_satisfied(self):
+        """
+        Forgets the cached satisfied cells. This is done automatically when
+        a symbol of the clause is invalidated.
+        """
+        self.satisfied_mask.fill(False)
+        self.finished = False
+
+    def get_forced(self) -> numpy.ndarray:
+        """
+        Returns a boolean array whose rows mark the cells where the
+        corresponding literal is unknown but all other literals are false,
+        so the literal is forced to be true. Also records the satisfied
+        cells of the clause. The returned array might be overwritten by the
+        next call.
+        """
+        if self.kernel is not None:
+            self.kernel(self.tables, self.indices, self.signs,
+                        self.satisfied_mask, self.forced)
+            return self.forced.reshape(
+                (len(self.literals),) + tuple(self.shape))
+
+        # count the false literals on the strided views of the symbols
+        falses = self.falses
+        cells = self.cells
+        satisfied = self.satisfied_mask.reshape(self.shape)
+        falses.fill(0)
+        for lit in self.literals:
+            if lit.sign:
+                numpy.less(lit.table, 0, out=cells)
+            else:
+                numpy.greater(lit.table, 0, out=cells)
+            numpy.add(falses, cells, out=falses)
+            if lit.sign:
+                numpy.greater(lit.table, 0, out=cells)
+            else:
+                numpy.less(lit.table, 0, out=cells)
+            numpy.logical_or(satisfied, cells, out=satisfied)
+
+        # an unknown literal is forced where all others are false
+        numpy.equal(falses, len(self.literals) - 1, out=cells)
+        forced = self.forced
+        for idx, lit in enumerate(self.literals):
+            row = forced[idx, ...]
+            numpy.equal(lit.table, 0, out=row)
+            numpy.logical_and(row, cells, out=row)
+        return forced
+
 
 class Theory:
     """
@@ -341,6 +659,17 @@ class Theory:
         self.symbols = symbols
         self.clauses = clauses
         self.size = None
+        self.buffer = None
+        self.offsets = None
+        self.batches = None
+
+        # the indices of clauses that use a given symbol
+        self.sym_to_clauses = {sym: [] for sym in symbols}
+        for idx, cla in enumerate(clauses):
+            for lit in cla.literals:
+                uses = self.sym_to_clauses[lit.symbol]
+                if idx not in uses:
+                    uses.append(idx)
 
     def print(self):
         print("size: " + str(self.size))
@@ -350,13 +679,34 @@ class Theory:
             print(cla)
 
     def create_tables(self, size: int):
+        """
+        Creates the tables of all symbols as views into a single buffer, so
+        literals of different clauses can be gathered in one operation. The
+        first cell of the buffer is a true constant for padding. Each table
+        starts at a multiple of 64 bytes.
+        """
         assert size >= 1
         self.size = size
+
+        self.offsets = {}
+        length = 1
         for sym in self.symbols:
-            sym.create_table(size)
+            length += -length % 64
+            self.offsets[sym] = length
+            length += size ** sym.arity
+        self.buffer = empty_aligned(length, numpy.int8)
+        self.buffer.fill(0)
+        self.buffer[0] = 1
+
+        for sym in self.symbols:
+            start = self.offsets[sym]
+            sym.create_table(size, self.buffer[start:start + size ** sym.arity])
         for cla in self.clauses:
             cla.create_tables()
 
+        # only needed for batches of states, built on first use
+        self.batches = None
+
     def print_tables(self):
         for sym in self.symbols:
             print(sym.name + ": " + str(sym.table.flatten()))
@@ -376,19 +726,131 @@ class Theory:
                 print("  " + str(cla))
 
     def propagate(self):
+        """
+        Propagates all clauses until a fixed point is reached. Clauses are
+        processed from a work queue, and only the clauses that use an
+        updated symbol are queued again. Returns whether anything has been
+        updated.
+        """
         updated = False
-        counter = 0
-        idx = 0
-        while counter < len(self.clauses):
-            cla = self.clauses[idx]
-            if cla.propagate():
+        queue = deque(range(len(self.clauses)))
+        queued = bytearray(b'\x01') * len(self.clauses)
+
+        while queue:
+            idx = queue.popleft()
+            queued[idx] = 0
+            for sym in self.clauses[idx].propagate():
                 updated = True
-                counter = 1
-            else:
-                counter += 1
-            idx += 1
-            if idx >= len(self.clauses):
-                idx = 0
+                for idx2 in self.sym_to_clauses[sym]:
+                    if not queued[idx2]:
+                        queued[idx2] = 1
+                        queue.append(idx2)
+        return updated
+
+    def get_forced_matrix(self, states: numpy.ndarray) -> numpy.ndarray:
+        """
+        Returns a boolean matrix whose rows mark the clauses that have a
+        forced cell in the corresponding row of states, which are copies of
+        the table buffer. The states are processed in chunks, so that each
+        gather of a batch of clauses reads at most BATCH_BYTES values.
+        """
+        assert states.ndim == 2 and states.shape[1] == len(self.buffer)
+        assert states.dtype == numpy.int8
+        result = numpy.zeros((states.shape[0], len(self.clauses)), dtype=bool)
+        for bucket, indices, signs in self.get_batches():
+            step = max(1, BATCH_BYTES // indices.size)
+            for start in range(0, states.shape[0], step):
+                chunk = slice(start, start + step)
+                result[chunk, bucket] = self.get_forced_chunk(
+                    states[chunk], indices, signs)
+        return result
+
+    def get_batches(self) -> List[Tuple[numpy.ndarray, numpy.ndarray,
+                                        numpy.ndarray]]:
+        """
+        Returns the clauses grouped by their number of cells, together with
+        the offsets of their literals into the buffer and their signs. Short
+        clauses are padded with the negated true constant at offset zero.
+        These are only used by get_forced_matrix, so they are built on the
+        first call.
+        """
+        if self.batches is not None:
+            return self.batches
+
+        buckets = {}
+        for idx, cla in enumerate(self.clauses):
+            buckets.setdefault(int(numpy.prod(cla.shape)), []).append(idx)
+
+        self.batches = []
+        for cells, bucket in buckets.items():
+            count = max(len(self.clauses[idx].literals) for idx in bucket)
+            indices = numpy.zeros((len(bucket), count, cells), dtype=numpy.int64)
+            signs = numpy.full((len(bucket), count, 1), -1, dtype=numpy.int8)
+            for pos, idx in enumerate(bucket):
+                cla = self.clauses[idx]
+                for k, lit in enumerate(cla.literals):
+                    numpy.add(lit.indices, self.offsets[lit.symbol],
+                              out=indices[pos, k].reshape(cla.shape))
+                signs[pos, :len(cla.literals), 0] = cla.signs
+            self.batches.append((numpy.array(bucket), indices, signs))
+        return self.batches
+
+    @staticmethod
+    def get_forced_chunk(states: numpy.ndarray, indices: numpy.ndarray,
+                         signs: numpy.ndarray) -> numpy.ndarray:
+        """
+        Returns a boolean matrix whose rows mark the clauses of a batch that
+        have a forced cell in the corresponding row of states.
+        """
+        values = states.take(indices, axis=1)
+        numpy.multiply(values, signs, out=values)
+
+        # work on bit planes with 8 cells per byte
+        pos = numpy.packbits(values > 0, axis=-1)
+        nonneg = numpy.packbits(values >= 0, axis=-1)
+        once = numpy.zeros_like(nonneg[:, :, 0])
+        twice = numpy.zeros_like(once)
+        for k in range(nonneg.shape[2]):
+            twice |= once & nonneg[:, :, k]
+            once |= nonneg[:, :, k]
+        forced = once & ~twice & ~numpy.bitwise_or.reduce(pos, axis=2)
+        return forced.any(axis=-1)
+
+    def get_state(self) -> numpy.ndarray:
+        """
+        Returns a copy of the buffer holding all symbol tables.
+        """
+        return self.buffer.copy()
+
+    def set_state(self, state: numpy.ndarray):
+        """
+        Overwrites all symbol tables from a copy of the buffer. Values may
+        be cleared this way, so all symbols are invalidated.
+        """
+        self.buffer[:] = state
+        for sym in self.symbols:
+            sym.invalidate()
+
+    def propagate_states(self, states: numpy.ndarray) -> numpy.ndarray:
+        """
+        Propagates each row of states, which are copies of the table
+        buffer, and updates them in place. The rows that have something
+        to propagate are found with one vectorized check, and only those
+        are loaded and propagated. Returns a boolean array telling which
+        rows have been updated. The current state is kept.
+        """
+        assert states.ndim == 2 and states.dtype == numpy.int8
+        forced = self.get_forced_matrix(states).any(axis=1)
+        updated = numpy.zeros(states.shape[0], dtype=bool)
+        if not forced.any():
+            return updated
+
+        saved = self.get_state()
+        for idx in numpy.flatnonzero(forced):
+            self.set_state(states[idx])
+            updated[idx] = self.propagate()
+            states[idx] = self.buffer
+        self.set_state(saved)
         return updated
 
     def print(self):
@@ -27,6 +27,9 @@ setup(
     install_requires=[
         'numpy',
     ],
+    extras_require={
+        'numba': ['numba'],
+    },
     entry_points={
         'console_scripts': [
             'relsat = relsat.__main__:run'
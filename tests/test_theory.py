@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import io
+import unittest
+
+import numpy
+
+from relsat import theory
+from relsat.theory import Clause, Literal, Symbol, Theory
+
+
+class TheoryTest(unittest.TestCase):
+    def propagate_after_clear(self):
+        a = Symbol('a', 1)
+        b = Symbol('b', 1)
+        thy = Theory([a, b], [
+            Clause([
+                Literal(1, True, a, [0]),
+                Literal(1, True, b, [0]),
+            ]),
+        ])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            thy.create_tables(2)
+            a.set_value([0], -1)
+            a.set_value([1], 1)
+            thy.propagate()
+            self.assertEqual(b.table.tolist(), [1, 0])
+
+            a.set_constant(0)
+            b.set_constant(0)
+            a.set_constant(-1)
+            thy.propagate()
+        self.assertEqual(b.table.tolist(), [1, 1])
+
+    def test_propagate_after_clear(self):
+        self.propagate_after_clear()
+
+    def test_propagate_after_clear_without_numba(self):
+        saved = theory.numba
+        theory.numba = None
+        try:
+            self.propagate_after_clear()
+        finally:
+            theory.numba = saved
+
+    def finished_with_unknowns(self):
+        a = Symbol('a', 1)
+        b = Symbol('b', 1)
+        c = Symbol('c', 1)
+        cla = Clause([
+            Literal(1, True, a, [0]),
+            Literal(1, True, b, [0]),
+            Literal(1, True, c, [0]),
+        ])
+        thy = Theory([a, b, c], [cla])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            thy.create_tables(2)
+            c.set_constant(1)
+            self.assertFalse(thy.propagate())
+        self.assertTrue(cla.finished)
+
+    def test_finished_with_unknowns(self):
+        self.finished_with_unknowns()
+
+    def test_finished_with_unknowns_without_numba(self):
+        saved = theory.numba
+        theory.numba = None
+        try:
+            self.finished_with_unknowns()
+        finally:
+            theory.numba = saved
+
+    def propagate_nullary(self):
+        p = Symbol('p', 0)
+        q = Symbol('q', 0)
+        thy = Theory([p, q], [
+            Clause([
+                Literal(0, False, p, []),
+                Literal(0, True, q, []),
+            ]),
+        ])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            thy.create_tables(3)
+            p.set_value([], 1)
+            self.assertTrue(thy.get_forced_matrix(thy.get_state()[None]).all())
+            self.assertTrue(thy.propagate())
+        self.assertEqual(q.table, 1)
+        self.assertEqual(thy.clauses[0].satisfied(), 1)
+
+    def test_propagate_nullary(self):
+        self.propagate_nullary()
+
+    def test_propagate_nullary_without_numba(self):
+        saved = theory.numba
+        theory.numba = None
+        try:
+            self.propagate_nullary()
+        finally:
+            theory.numba = saved
+
+    def test_literal_view(self):
+        rng = numpy.random.default_rng(1)
+        for vars in [[0, 1, 2, 0], [0, 1, 0, 2], [2, 0, 2, 0]]:
+            sym = Symbol('s', 4)
+            sym.create_table(3)
+            sym.table[...] = rng.integers(-1, 2, sym.table.shape)
+
+            # the last variable is a dummy one
+            lit = Literal(4, True, sym, vars)
+            lit.create_table()
+            flat = sym.table.reshape(-1)
+            for coords in numpy.ndindex(3, 3, 3, 3):
+                value = sym.table[tuple(coords[var] for var in vars)]
+                cell = tuple(min(c, n - 1)
+                             for c, n in zip(coords, lit.table.shape))
+                self.assertEqual(lit.table[cell], value)
+                self.assertEqual(flat[lit.indices[cell]], value)
+
+    def test_propagate_states(self):
+        a = Symbol('a', 1)
+        b = Symbol('b', 1)
+        c = Symbol('c', 1)
+        thy = Theory([a, b, c], [
+            # padded with the constant to the length of the next clause
+            Clause([
+                Literal(1, False, a, [0]),
+                Literal(1, True, b, [0]),
+            ]),
+            Clause([
+                Literal(1, False, b, [0]),
+                Literal(1, False, c, [0]),
+                Literal(1, True, a, [0]),
+            ]),
+        ])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            thy.create_tables(3)
+            empty = thy.get_state()
+            states = [empty]
+            for values in [[(a, 0, 1)], [(b, 1, 1), (c, 1, 1)],
+                           [(a, 2, 1), (b, 2, 1)]]:
+                thy.set_state(empty)
+                for sym, idx, value in values:
+                    sym.set_value([idx], value)
+                states.append(thy.get_state())
+            states = numpy.array(states)
+
+            # propagate each state on its own
+            expected = states.copy()
+            for idx in range(len(states)):
+                thy.set_state(states[idx])
+                thy.propagate()
+                expected[idx] = thy.get_state()
+
+            thy.set_state(empty)
+            c.set_value([2], -1)
+            current = thy.get_state()
+
+            saved = theory.BATCH_BYTES
+            try:
+                for batch_bytes in [saved, 1]:
+                    theory.BATCH_BYTES = batch_bytes
+                    self.assertEqual(
+                        thy.get_forced_matrix(states).tolist(),
+                        [[False, False], [True, False],
+                         [False, True], [False, False]])
+
+                    result = states.copy()
+                    updated = thy.propagate_states(result)
+                    self.assertEqual(updated.tolist(),
+                                     [False, True, True, False])
+                    self.assertTrue((result == expected).all())
+                    self.assertTrue((result[~updated] == states[~updated]).all())
+                    self.assertTrue((thy.buffer == current).all())
+            finally:
+                theory.BATCH_BYTES = saved
+
+    @unittest.skipIf(theory.numba is None, "numba is not installed")
+    def test_forced_kernel(self):
+        rng = numpy.random.default_rng(1)
+        for signs in [(True,), (False, True), (True, True, False),
+                      (False, False, True, False)]:
+            tables = tuple(rng.integers(-1, 2, 50).astype(numpy.int8)
+                           for _ in signs)
+            indices = rng.integers(0, 50, (len(signs), 1000)).astype(
+                numpy.int32)
+            factors = numpy.array([1 if sign else -1 for sign in signs],
+                                 dtype=numpy.int8)
+            satisfied = rng.random(1000) < 0.2
+
+            satisfied1 = satisfied.copy()
+            forced1 = numpy.empty(indices.shape, dtype=bool)
+            theory.forced_cells(tables, indices, factors, satisfied1, forced1)
+
+            satisfied2 = satisfied.copy()
+            forced2 = numpy.empty(indices.shape, dtype=bool)
+            theory.forced_kernel(signs)(
+                tables, indices, factors, satisfied2, forced2)
+
+            self.assertTrue(forced1.any())
+            self.assertTrue((forced1 == forced2).all())
+            self.assertTrue((satisfied1 == satisfied2).all())
+
+
+if __name__ == '__main__':
+    unittest.main()